@@ -653,6 +653,9 @@ class BlockedDiscreteOperator(_DiscreteOperatorBase):
         return True
 
     def _matmat(self, x):
+        from bempp.api.assembly.discrete_boundary_operator import (
+            ZeroDiscreteBoundaryOperator,
+        )
         from bempp.api.utils.data_types import combined_type
 
         if not self._fill_complete():
@@ -667,6 +670,10 @@ class BlockedDiscreteOperator(_DiscreteOperatorBase):
             col_dim = 0
             local_res = res[row_dim : row_dim + self._rows[i], :]
             for j in range(self._ndims[1]):
+                if isinstance(self._operators[i, j], ZeroDiscreteBoundaryOperator):
+                    # Zero blocks do not contribute to the result.
+                    col_dim += self._cols[j]
+                    continue
                 local_x = x[col_dim : col_dim + self._cols[j], :]
                 op_is_complex = _np.iscomplexobj(self._operators[i, j].dtype.type(1))
                 if _np.iscomplexobj(x) and not op_is_complex:
@@ -1,5 +1,9 @@
 """Data structures for assembled boundary operators."""
 
+import os as _os
+from functools import lru_cache as _lru_cache
+
+import numba as _numba
 import numpy as _np
 from bempp.helpers import timeit as _timeit
 from scipy.sparse.linalg.interface import LinearOperator as _LinearOperator
@@ -7,6 +11,15 @@ from scipy.sparse.linalg.interface import LinearOperator as _LinearOperator
 # Disable warnings for differing overridden parameters
 # pylint: disable=W0221
 
+# Diagonal operators above this size are applied with a parallel Numba kernel.
+_DIAGONAL_NUMBA_THRESHOLD = 100000
+
+# Single precision dense block products with at least this many columns are
+# split across threads if threaded products are enabled.
+_THREADED_MATMAT_MIN_COLUMNS = 16
+
+_FLOAT64 = _np.dtype("float64")
+
 
 class _DiscreteOperatorBase(_LinearOperator):
     """Discrete boundary operator base."""
@@ -57,14 +70,25 @@ class _ScaledDiscreteOperator(_DiscreteOperatorBase):
     """Return a scaled operator."""
 
     def __init__(self, op, alpha):
-        dtype = _np.find_common_type([op.dtype], [type(alpha)])
+        dtype = _find_common_type((op.dtype,), (type(alpha),))
         self._op = op
         self._alpha = alpha
         super().__init__(dtype, op.shape)
 
     def _matvec(self, x):
         """Matvec."""
-        return self._alpha * (self._op @ x)
+        alpha = self._alpha
+        y = self._op @ x
+        # Scale in place if the result can hold the scaled values and
+        # is not a view of the input or of read-only operator data.
+        if (
+            isinstance(y, _np.ndarray)
+            and y.flags.writeable
+            and _np.result_type(alpha, y) == y.dtype
+            and not _np.may_share_memory(x, y)
+        ):
+            return _np.multiply(alpha, y, out=y)
+        return alpha * y
 
     @property
     def A(self):
@@ -86,22 +110,31 @@ class _SumDiscreteOperator(_DiscreteOperatorBase):
 
         self._op1 = op1
         self._op2 = op2
+        self._A_cache = None
 
-        dtype = _np.find_common_type([op1.dtype, op2.dtype], [])
+        dtype = _find_common_type((op1.dtype, op2.dtype))
 
         super().__init__(dtype, op1.shape)
 
     def _matvec(self, x):
         """Evaluate matvec."""
-        return self._op1 @ x + self._op2 @ x
+        op1 = self._op1
+        op2 = self._op2
+        return op1 @ x + op2 @ x
+
+    def _invalidate(self):
+        """Discard the cached matrix representation."""
+        self._A_cache = None
 
     @property
     def A(self):
         """Return matrix representation."""
 
-        res1, res2 = _get_dense(self._op1.A, self._op2.A)
+        if self._A_cache is None:
+            res1, res2 = _get_dense(self._op1.A, self._op2.A)
+            self._A_cache = res1 + res2
 
-        return res1 + res2
+        return self._A_cache
 
 
 class _ProductDiscreteOperator(_DiscreteOperatorBase):
@@ -117,22 +150,43 @@ class _ProductDiscreteOperator(_DiscreteOperatorBase):
 
         self._op1 = op1
         self._op2 = op2
+        self._A_cache = None
+
+        # Products of two sparse operators are precomputed so that a
+        # matvec is a single sparse matvec with the fused operator.
+        self._fused = None
+        if isinstance(op1, SparseDiscreteBoundaryOperator) and isinstance(
+            op2, SparseDiscreteBoundaryOperator
+        ):
+            self._fused = SparseDiscreteBoundaryOperator(op1.A @ op2.A)
+            self._A_cache = self._fused.A
 
-        dtype = _np.find_common_type([op1.dtype, op2.dtype], [])
+        dtype = _find_common_type((op1.dtype, op2.dtype))
 
         super().__init__(dtype, (op1.shape[0], op2.shape[1]))
 
     def _matvec(self, x):
         """Evaluate matvec."""
-        return self._op1 @ (self._op2 @ x)
+        fused = self._fused
+        if fused is not None:
+            return fused @ x
+        op1 = self._op1
+        op2 = self._op2
+        return op1 @ (op2 @ x)
+
+    def _invalidate(self):
+        """Discard the cached matrix representation."""
+        self._A_cache = None
 
     @property
     def A(self):
         """Return matrix representation."""
 
-        res1, res2 = _get_dense(self._op1.A, self._op2.A)
+        if self._A_cache is None:
+            res1, res2 = _get_dense(self._op1.A, self._op2.A, keep_sparse=True)
+            self._A_cache = res1 @ res2
 
-        return res1 @ res2
+        return self._A_cache
 
 
 class GenericDiscreteBoundaryOperator(_DiscreteOperatorBase):
@@ -144,21 +198,38 @@ class GenericDiscreteBoundaryOperator(_DiscreteOperatorBase):
         super().__init__(evaluator.dtype, evaluator.shape)
         self._evaluator = evaluator
         self._is_complex = self.dtype == "complex128" or self.dtype == "complex64"
+        self._A_cache = None
 
-    def _matvec(self, x):
+        # Bind a matvec specialised to the operator type, so that
+        # calls do not need to branch on the operator dtype.
         if self._is_complex:
-            return self._evaluator.matvec(x)
-        if _np.iscomplexobj(x):
-            return self._evaluator.matvec(_np.real(x)) + 1j * self._evaluator.matvec(
-                _np.imag(x)
-            )
+            self._matvec = self._matvec_complex
         else:
-            return self._evaluator.matvec(x)
+            self._matvec = self._matvec_real
+
+    def _matvec(self, x):
+        # Replaced by _matvec_complex or _matvec_real in the constructor.
+        return self._matvec_complex(x) if self._is_complex else self._matvec_real(x)
+
+    def _matvec_complex(self, x):
+        return self._evaluator.matvec(x)
+
+    def _matvec_real(self, x):
+        matvec = self._evaluator.matvec
+        if _np.iscomplexobj(x):
+            return matvec(_np.real(x)) + 1j * matvec(_np.imag(x))
+        return matvec(x)
+
+    def _invalidate(self):
+        """Discard the cached dense representation."""
+        self._A_cache = None
 
     @property
     def A(self):
         """Convert to dense."""
-        return self @ _np.eye(self.shape[1])
+        if self._A_cache is None:
+            self._A_cache = _to_dense_by_columns(self)
+        return self._A_cache
 
 
 class DenseDiscreteBoundaryOperator(_DiscreteOperatorBase):
@@ -174,61 +245,65 @@ class DenseDiscreteBoundaryOperator(_DiscreteOperatorBase):
     def __init__(self, impl):
         """Constructor. Should not be called by the user."""
         self._impl = impl
+        self._is_single_precision = impl.dtype in ["float32", "complex64"]
         super().__init__(impl.dtype, impl.shape)
 
     def _matmat(self, x):
 
-        if _np.iscomplexobj(x) and not _np.iscomplexobj(self.A):
-            return self.A.dot(_np.real(x).astype(self.dtype)) + 1j * self.A.dot(
-                _np.imag(x).astype(self.dtype)
-            )
-        return self.A.dot(x.astype(self.dtype))
+        A = self._impl
+        if _np.iscomplexobj(x) and not _np.iscomplexobj(A):
+            return _apply_real_op_to_complex(A, x)
+        if x.dtype != A.dtype:
+            x = x.astype(A.dtype)
+        if (
+            self._is_single_precision
+            and x.shape[1] >= _THREADED_MATMAT_MIN_COLUMNS
+            and _use_threaded_matmat()
+        ):
+            return _threaded_matmat(A, x)
+        return A.dot(x)
 
     def __add__(self, other):
         if isinstance(other, DenseDiscreteBoundaryOperator):
-            return DenseDiscreteBoundaryOperator(self.A + other.A)
+            return DenseDiscreteBoundaryOperator(self._impl + other.A)
         else:
             return super().__add__(other)
 
     def __neg__(self):
-        return DenseDiscreteBoundaryOperator(-self.A)
+        return DenseDiscreteBoundaryOperator(-self._impl)
 
     def __mul__(self, other):
         return self.dot(other)
 
     def dot(self, other):
         """Form the product with another object."""
+        A = self._impl
         if isinstance(other, DenseDiscreteBoundaryOperator):
-            return DenseDiscreteBoundaryOperator(self.A.dot(other.A))
+            return DenseDiscreteBoundaryOperator(A.dot(other.A))
         if _np.isscalar(other):
-            if self.A.dtype in ["float32", "complex64"]:
+            if self._is_single_precision:
                 # Necessary to ensure that scalar multiplication does not change
                 # precision to double precision.
                 if _np.iscomplexobj(other):
-                    return DenseDiscreteBoundaryOperator(
-                        self.A * _np.dtype("complex64").type(other)
-                    )
+                    other = _np.complex64(other)
                 else:
-                    return DenseDiscreteBoundaryOperator(
-                        self.A * _np.dtype("float32").type(other)
-                    )
-            else:
-                return DenseDiscreteBoundaryOperator(self.A * other)
+                    other = _np.float32(other)
+            return DenseDiscreteBoundaryOperator(A * other)
         return super().dot(other)
 
     def __rmul__(self, other):
         if _np.isscalar(other):
-            return DenseDiscreteBoundaryOperator(self.A * other)
+            return DenseDiscreteBoundaryOperator(self._impl * other)
         else:
             return NotImplemented
 
     def _transpose(self):
         """Transpose of the operator."""
-        return DenseDiscreteBoundaryOperator(self.A.T)
+        return DenseDiscreteBoundaryOperator(self._impl.T)
 
     def _adjoint(self):
         """Adjoint of the operator."""
-        return DenseDiscreteBoundaryOperator(self.A.conjugate().transpose())
+        return DenseDiscreteBoundaryOperator(self._impl.conjugate().transpose())
 
     # pylint: disable=invalid-name
     @property
@@ -249,16 +324,29 @@ class DiagonalOperator(_DiscreteOperatorBase):
 
     def __init__(self, values, shape=None):
         """Constructor. Should not be called by the user."""
-        self._values = values.ravel()
+        self._values = _np.ascontiguousarray(values.ravel())
         if shape is None:
             shape = (len(values), len(values))
         super().__init__(values.dtype, shape)
 
     def _matvec(self, x):
 
-        vec_shape = x.shape
+        values = self._values
+        result = _np.empty(x.shape, dtype=_np.result_type(values, x))
+        if len(values) > _DIAGONAL_NUMBA_THRESHOLD:
+            _diagonal_multiply(
+                values, _np.ascontiguousarray(x).reshape(-1), result.reshape(-1)
+            )
+        else:
+            _np.multiply(values, x.reshape(-1), out=result.reshape(-1))
+        return result
+
+    def _matmat(self, x):
 
-        return (self._values * x.ravel()).reshape(vec_shape)
+        values = self._values
+        result = _np.empty(x.shape, dtype=_np.result_type(values, x))
+        _np.multiply(values[:, _np.newaxis], x, out=result)
+        return result
 
     def __add__(self, other):
 
@@ -324,12 +412,27 @@ class SparseDiscreteBoundaryOperator(_DiscreteOperatorBase):
         """Constructor. Should not e called by the user."""
         super(SparseDiscreteBoundaryOperator, self).__init__(impl.dtype, impl.shape)
         self._impl = impl
+        self._csc_cache = None
+
+        # Keep a CSR copy with sorted indices for the products.
+        csr = impl.tocsr()
+        if not csr.has_sorted_indices:
+            csr = csr.sorted_indices()
+        self._csr = csr
 
     def _matmat(self, vec):
         """Multiply the operator with a numpy vector or matrix x."""
-        if self.dtype == "float64" and _np.iscomplexobj(vec):
-            return self.A * _np.real(vec) + 1j * (self.A * _np.imag(vec))
-        return self.A * vec
+        csr = self._csr
+        if csr.dtype == "float64" and _np.iscomplexobj(vec):
+            return _apply_real_op_to_complex(csr, vec)
+        return csr @ vec
+
+    @property
+    def _csc(self):
+        """Return the matrix in CSC format."""
+        if self._csc_cache is None:
+            self._csc_cache = self._impl.tocsc()
+        return self._csc_cache
 
     def _transpose(self):
         """Return the transpose of the discrete operator."""
@@ -397,6 +500,7 @@ class InverseSparseDiscreteBoundaryOperator(_DiscreteOperatorBase):
 
         self._solver = _Solver(operator)
         self._operator = operator
+        self._A_cache = None
         super().__init__(self._solver.dtype, self._solver.shape)
 
     def _matmat(self, vec):
@@ -404,12 +508,18 @@ class InverseSparseDiscreteBoundaryOperator(_DiscreteOperatorBase):
 
         return self._solver.solve(vec)
 
+    def _invalidate(self):
+        """Discard the cached dense representation."""
+        self._A_cache = None
+
+    @property
     def A(self):
         """Return dense representation."""
 
-        eye = _np.eye(self.shape[1])
+        if self._A_cache is None:
+            self._A_cache = _to_dense_by_columns(self)
 
-        return self @ eye
+        return self._A_cache
 
 
 class ZeroDiscreteBoundaryOperator(_DiscreteOperatorBase):
@@ -425,24 +535,29 @@ class ZeroDiscreteBoundaryOperator(_DiscreteOperatorBase):
         The number of rows in the operator.
     columns : int
         The number of columns in the operator.
+    read_only_result : bool
+        If True, products return a read-only view that broadcasts
+        a single zero instead of allocating a new array of zeros.
 
     """
 
-    def __init__(self, rows, columns):
+    def __init__(self, rows, columns, read_only_result=False):
         """Construct a zero operator."""
-        super(ZeroDiscreteBoundaryOperator, self).__init__(
-            _np.dtype("float64"), (rows, columns)
-        )
+        super(ZeroDiscreteBoundaryOperator, self).__init__(_FLOAT64, (rows, columns))
+        self._read_only_result = read_only_result
 
     def _matmat(self, x):
-        return _np.zeros((self.shape[0], x.shape[1]), dtype="float64")
+        shape = (self.shape[0], x.shape[1])
+        if self._read_only_result:
+            return _np.broadcast_to(_np.zeros((), dtype=_FLOAT64), shape)
+        return _np.zeros(shape, dtype=_FLOAT64)
 
     @property
     def A(self):
         """Return as dense."""
         from scipy.sparse import csc_matrix
 
-        return csc_matrix((self.shape[0], self.shape[1]), dtype="float64")
+        return csc_matrix((self.shape[0], self.shape[1]), dtype=_FLOAT64)
 
 
 class DiscreteRankOneOperator(_DiscreteOperatorBase):
@@ -464,26 +579,39 @@ class DiscreteRankOneOperator(_DiscreteOperatorBase):
 
     def __init__(self, column, row):
         """Construct a discrete rank one operator."""
-        if row.dtype == "complex128" or column.dtype == "complex128":
+        from scipy.linalg.blas import get_blas_funcs
+
+        if _np.iscomplexobj(row) or _np.iscomplexobj(column):
             dtype = "complex128"
+            # The unconjugated rank one update for complex data.
+            self._ger = get_blas_funcs("geru", dtype=dtype)
         else:
             dtype = "float64"
+            self._ger = get_blas_funcs("ger", dtype=dtype)
 
-        self._row = row.ravel()
-        self._column = column.ravel()
+        # Contiguous storage in the operator type so that the
+        # vectors can be passed to BLAS without copies.
+        self._row = _np.ascontiguousarray(row.ravel(), dtype=dtype)
+        self._column = _np.ascontiguousarray(column.ravel(), dtype=dtype)
+        self._A_cache = None
 
         shape = (len(self._column), len(self._row))
         super().__init__(dtype, shape)
 
     def _matvec(self, x):
         if x.ndim > 1:
-            return _np.outer(self._column, _np.dot(self._row, x))
-        else:
-            return self._column * _np.dot(self._row, x)
+            return self._matmat(x)
+        return self._column * _np.dot(self._row, x)
+
+    def _matmat(self, x):
+        column = self._column
+        coeffs = _np.dot(self._row, x)
+        if coeffs.dtype == column.dtype:
+            return self._ger(1.0, column, coeffs)
+        return _np.outer(column, coeffs)
 
     def _rmatvec(self, x):
-        # pylint: disable=protected-access
-        return self._adjoint()._matvec(x)
+        return self._row.conjugate() * _np.dot(self._column.conjugate(), x)
 
     def _transpoe(self):
         return DiscreteRankOneOperator(self._row, self._column)
@@ -491,10 +619,16 @@ class DiscreteRankOneOperator(_DiscreteOperatorBase):
     def _adjoint(self):
         return DiscreteRankOneOperator(self._row.conjugate(), self._column.conjugate())
 
+    def _invalidate(self):
+        """Discard the cached dense representation."""
+        self._A_cache = None
+
     @property
     def A(self):
         """Return as dense."""
-        return _np.outer(self._column, self._row)
+        if self._A_cache is None:
+            self._A_cache = _np.outer(self._column, self._row)
+        return self._A_cache
 
 
 def as_matrix(operator):
@@ -517,13 +651,10 @@ def as_matrix(operator):
     the assembler type.
 
     """
-    from numpy import eye
-
     if hasattr(operator, "A"):
         return operator.A
 
-    cols = operator.shape[1]
-    return operator @ eye(cols)
+    return _to_dense_by_columns(operator)
 
 
 class _Solver(object):  # pylint: disable=too-few-public-methods
@@ -536,7 +667,8 @@ class _Solver(object):  # pylint: disable=too-few-public-methods
         from scipy.sparse import csc_matrix
 
         if isinstance(operator, SparseDiscreteBoundaryOperator):
-            mat = operator.A
+            # pylint: disable=protected-access
+            mat = operator._csc
         elif isinstance(operator, csc_matrix):
             mat = operator
         else:
@@ -550,10 +682,12 @@ class _Solver(object):  # pylint: disable=too-few-public-methods
         from scipy.sparse.linalg import splu
 
         self._solve_fun = None
+        # The (pseudo-)inverse of an m x n matrix is n x m.
         self._shape = (mat.shape[1], mat.shape[0])
         self._dtype = mat.dtype
-
-        use_mkl_pardiso = False
+        # Complex right-hand sides of real systems are split into real
+        # and imaginary parts. Decide once instead of in every solve.
+        self._split_complex_rhs = self._dtype == "float64"
 
         # pylint: disable=bare-except
         try:
@@ -562,42 +696,63 @@ class _Solver(object):  # pylint: disable=too-few-public-methods
 
             # pylint: disable=invalid-name
             solver_interface = PardisoInterface
-            actual_mat = mat.tocsr()
+            matrix_format = "csr"
             use_mkl_pardiso = True
         except:
             solver_interface = splu
-            actual_mat = mat
+            matrix_format = "csc"
+            use_mkl_pardiso = False
+
+        actual_mat = mat.asformat(matrix_format)
+
+        if mat.shape[0] != mat.shape[1]:
+            # The adjoint is applied for every right-hand side, so it is
+            # stored in CSR format with sorted indices.
+            mat_hermitian = actual_mat.conjugate().transpose().tocsr()
+            mat_hermitian.sort_indices()
 
         if mat.shape[0] == mat.shape[1]:
             # Square matrix case
             solver = solver_interface(actual_mat)
-            self._solve_fun = solver.solve
         elif mat.shape[0] > mat.shape[1]:
             # Thin matrix case
-            mat_hermitian = actual_mat.conjugate().transpose()
-            if use_mkl_pardiso:
-                solver = solver_interface((mat_hermitian * mat).tocsr())
-            else:
-                solver = solver_interface((mat_hermitian * mat).tocsc())
-            self._solve_fun = lambda x: solver.solve(mat_hermitian * x)
+            solver = solver_interface((mat_hermitian @ mat).asformat(matrix_format))
         else:
             # Thick matrix case
+            solver = solver_interface((mat @ mat_hermitian).asformat(matrix_format))
 
-            mat_hermitian = actual_mat.conjugate().transpose()
-            if use_mkl_pardiso:
-                solver = solver_interface((mat * mat_hermitian).tocsr())
-            else:
-                solver = solver_interface((mat * mat_hermitian).tocsc())
-            self._solve_fun = lambda x: mat_hermitian * solver.solve(x)
+        if use_mkl_pardiso:
+            # Pardiso takes blocks of right-hand sides in Fortran order.
+            solve = lambda x, s=solver: s.solve(_np.asfortranarray(x))
+        else:
+            solve = solver.solve
+
+        if mat.shape[0] == mat.shape[1]:
+            self._solve_fun = solve
+        elif mat.shape[0] > mat.shape[1]:
+            self._solve_fun = lambda x, s=solve, mh=mat_hermitian: s(mh @ x)
+        else:
+            self._solve_fun = lambda x, s=solve, mh=mat_hermitian: mh @ s(x)
 
     @_timeit
     def solve(self, rhs):
         """Solve with right-hand side mat."""
 
-        if self._dtype == "float64" and _np.iscomplexobj(rhs):
-            return self.solve(_np.real(rhs)) + 1j * self.solve(_np.imag(rhs))
+        solve_fun = self._solve_fun
+
+        if self._split_complex_rhs and _np.iscomplexobj(rhs):
+            # Solve for the real and imaginary parts as a single block
+            # of real right-hand sides.
+            columns = rhs.reshape(rhs.shape[0], -1)
+            count = columns.shape[1]
+            packed = _np.empty((rhs.shape[0], 2 * count), dtype=_FLOAT64)
+            packed[:, :count] = _np.real(columns)
+            packed[:, count:] = _np.imag(columns)
+            result = solve_fun(packed)
+            result = result[:, :count] + 1j * result[:, count:]
+            return result.reshape((result.shape[0],) + rhs.shape[1:])
 
-        return self._solve_fun(rhs)
+        return solve_fun(rhs)
 
     @property
     def shape(self):
@@ -610,13 +765,122 @@ class _Solver(object):  # pylint: disable=too-few-public-methods
         return self._dtype
 
 
-def _get_dense(A, B):
+@_lru_cache(maxsize=1)
+def _use_threaded_matmat():
+    """
+    Return true if dense block products should be split across threads.
+
+    Threading is only useful if the BLAS library runs single threaded,
+    which cannot be reliably detected. It is therefore enabled by setting
+    the environment variable BEMPP_THREADED_MATMAT=1. The result is
+    cached, so the variable is only read at the first dense block product.
+
+    """
+    if _os.environ.get("BEMPP_THREADED_MATMAT", "0") != "1":
+        return False
+    return _matmat_workers() > 1
+
+
+@_lru_cache(maxsize=1)
+def _matmat_workers():
+    """Return the number of CPUs available to this process."""
+    if hasattr(_os, "sched_getaffinity"):
+        return len(_os.sched_getaffinity(0))
+    return _os.cpu_count() or 1
+
+
+@_lru_cache(maxsize=1)
+def _get_matmat_executor():
+    """Return the thread pool shared by all threaded dense products."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    return ThreadPoolExecutor(max_workers=_matmat_workers())
+
+
+def _threaded_matmat(A, x):
+    """
+    Multiply A with x by distributing the columns of x across threads.
+
+    NumPy releases the GIL during the products, so that the column
+    chunks are processed in parallel even with a single threaded BLAS.
+
+    """
+    chunks = _np.array_split(x, min(_matmat_workers(), x.shape[1]), axis=1)
+    return _np.concatenate(list(_get_matmat_executor().map(A.dot, chunks)), axis=1)
+
+
+def _to_dense_by_columns(operator, block_size=64):
+    """
+    Convert an operator to a dense matrix by applying it to unit vectors.
+
+    The unit vectors are applied in blocks of block_size columns so that
+    only the result and a single block of the identity need to be stored.
+
+    """
+    rows, cols = operator.shape
+    unit_vectors = _np.zeros((cols, min(block_size, cols)), dtype=operator.dtype)
+    result = None
+
+    for start in range(0, cols, block_size):
+        count = min(block_size, cols - start)
+        diagonal = _np.arange(count)
+        unit_vectors[start + diagonal, diagonal] = 1
+        block = operator @ unit_vectors[:, :count]
+        unit_vectors[start + diagonal, diagonal] = 0
+        if result is None:
+            result = _np.empty((rows, cols), dtype=block.dtype)
+        result[:, start : start + count] = block
+
+    if result is None:
+        result = _np.empty((rows, cols), dtype=operator.dtype)
+
+    return result
+
+
+@_lru_cache(maxsize=64)
+def _find_common_type(array_types, scalar_types=()):
+    """Cached version of numpy.find_common_type for tuples of types."""
+    return _np.find_common_type(list(array_types), list(scalar_types))
+
+
+@_numba.njit(parallel=True, fastmath=True, cache=True)
+def _diagonal_multiply(values, vec, result):
+    """Multiply vec elementwise with values and store in result."""
+    for index in _numba.prange(values.shape[0]):
+        result[index] = values[index] * vec[index]
+
+
+def _apply_real_op_to_complex(A, x):
+    """
+    Apply a real matrix A to a complex array x.
+
+    Blocks with several columns are reinterpreted as real arrays with
+    interleaved real and imaginary parts, so that a single real
+    product computes both parts of the result. For a single vector
+    this is slower than two real products, which are used instead.
+
+    """
+    complex_dtype = _np.result_type(A.dtype, _np.complex64)
+    if x.ndim == 1 or x.shape[1] == 1:
+        result = _np.empty((A.shape[0],) + x.shape[1:], dtype=complex_dtype)
+        result.real = A @ _np.real(x).astype(A.dtype, copy=False)
+        result.imag = A @ _np.imag(x).astype(A.dtype, copy=False)
+        return result
+    x = _np.ascontiguousarray(x, dtype=complex_dtype)
+    packed = x.view(A.dtype)
+    result = _np.ascontiguousarray(A @ packed)
+    return result.view(complex_dtype).reshape((A.shape[0],) + x.shape[1:])
+
+
+def _get_dense(A, B, keep_sparse=False):
     """
     Convert to dense if necessary.
 
     If exactly one of A or B are sparse matrices,
     both are returned as dense. If both are sparse,
-    then both are returned as sparse.
+    then both are returned as sparse. If keep_sparse
+    is True a single sparse matrix is not converted,
+    which is sufficient for forming products.
 
     """
     a_is_sparse = False
@@ -630,9 +894,32 @@ def _get_dense(A, B):
     if a_is_sparse and b_is_sparse:
         return A, B
 
+    if keep_sparse:
+        return A, B
+
     if a_is_sparse:
-        A = A.todense()
+        A = _densify(A)
     if b_is_sparse:
-        B = B.todense()
+        B = _densify(B)
 
     return A, B
+
+
+def _densify(A):
+    """
+    Convert a sparse matrix to dense.
+
+    Raises a ValueError if the dense matrix would have more entries
+    than allowed by the parameter assembly.max_densification_entries.
+
+    """
+    import bempp.api
+
+    limit = bempp.api.GLOBAL_PARAMETERS.assembly.max_densification_entries
+    if limit is not None and A.shape[0] * A.shape[1] > limit:
+        raise ValueError(
+            f"Converting a sparse matrix of shape {A.shape} to dense exceeds "
+            + f"the limit of {limit} entries."
+        )
+
+    return A.todense()
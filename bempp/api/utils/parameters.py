@@ -57,6 +57,7 @@ class _Assembly(object):
         self.dense = _DenseAssembly()
         self.always_promote_to_double = False
         self.discretization_type = "galerkin"
+        self.max_densification_entries = None
 
 
 class DefaultParameters(object):
@@ -0,0 +1,441 @@
+"""Unit tests for discrete boundary operators."""
+
+# pylint: disable=C0103
+
+import numpy as _np
+import pytest
+from scipy.sparse import eye as _sparse_eye
+from scipy.sparse import random as _sparse_random
+
+import bempp.api
+from bempp.api.assembly.discrete_boundary_operator import (
+    DenseDiscreteBoundaryOperator,
+    SparseDiscreteBoundaryOperator,
+    InverseSparseDiscreteBoundaryOperator,
+    DiscreteRankOneOperator,
+    DiagonalOperator,
+    ZeroDiscreteBoundaryOperator,
+    _SumDiscreteOperator,
+    _ProductDiscreteOperator,
+)
+
+
+def _random_dense(rows, cols, seed=0):
+    """Return a dense operator with random entries."""
+    rng = _np.random.default_rng(seed)
+    return DenseDiscreteBoundaryOperator(rng.random((rows, cols)))
+
+
+def _random_sparse(rows, cols, seed=0):
+    """Return a sparse operator with random entries."""
+    return SparseDiscreteBoundaryOperator(
+        (
+            _sparse_random(rows, cols, density=0.2, random_state=seed)
+            + _sparse_eye(rows, cols)
+        ).tocsc()
+    )
+
+
+@pytest.mark.parametrize("combine", [_SumDiscreteOperator, _ProductDiscreteOperator])
+def test_composite_dense_representation_is_cached(combine):
+    """The dense representation of composite operators is computed once."""
+    op = combine(_random_dense(10, 10, 0), _random_dense(10, 10, 1))
+
+    first = op.A
+    assert op.A is first
+
+    op._invalidate()  # pylint: disable=protected-access
+    second = op.A
+    assert second is not first
+    _np.testing.assert_allclose(first, second)
+
+
+def test_inverse_sparse_dense_representation():
+    """The dense inverse agrees with the inverse of the sparse matrix."""
+    op = _random_sparse(10, 10)
+    inverse = InverseSparseDiscreteBoundaryOperator(op)
+
+    expected = _np.linalg.inv(op.A.toarray())
+    _np.testing.assert_allclose(inverse.A, expected, rtol=1e-10, atol=1e-12)
+    assert inverse.A is inverse.A
+
+
+@pytest.mark.parametrize(
+    "column_precision, row_precision",
+    [("float64", "complex128"), ("complex64", "float32"), ("float32", "float32")],
+)
+def test_rank_one_operator(column_precision, row_precision):
+    """A rank one operator agrees with the outer product of its vectors."""
+    rng = _np.random.default_rng(0)
+    column = rng.random(6).astype(column_precision)
+    row = rng.random(4).astype(row_precision)
+    if _np.iscomplexobj(column):
+        column += 1j * rng.random(6)
+    if _np.iscomplexobj(row):
+        row += 1j * rng.random(4)
+    op = DiscreteRankOneOperator(column, row)
+
+    x = rng.random(4)
+    X = rng.random((4, 3))
+
+    expected = _np.outer(column.astype("complex128"), row.astype("complex128"))
+    _np.testing.assert_allclose(op.A, expected)
+    _np.testing.assert_allclose(op @ x, expected @ x)
+    _np.testing.assert_allclose(op @ X, expected @ X)
+    y = rng.random(6) + 1j * rng.random(6)
+    _np.testing.assert_allclose(op.rmatvec(y), expected.conj().T @ y)
+
+
+def test_rank_one_operator_block_product():
+    """Blocks are applied to rank one operators with a single rank one update."""
+    column = _np.linspace(1, 2, 6)
+    row = _np.linspace(0, 1, 4)
+    op = DiscreteRankOneOperator(column, row)
+
+    calls = []
+    ger = op._ger  # pylint: disable=protected-access
+
+    def counting_ger(*args):
+        calls.append(args)
+        return ger(*args)
+
+    op._ger = counting_ger  # pylint: disable=protected-access
+    X = _np.ones((4, 7))
+
+    _np.testing.assert_allclose(op @ X, _np.outer(column, row) @ X)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("vec_type", ["float64", "complex128"])
+def test_sum_of_single_precision_operators(vec_type):
+    """Sums of single precision operators return single precision results."""
+    op1 = DenseDiscreteBoundaryOperator(_np.ones((8, 8), dtype="float32"))
+    op2 = DenseDiscreteBoundaryOperator(2 * _np.ones((8, 8), dtype="float32"))
+    op = _SumDiscreteOperator(op1, op2)
+
+    result = op @ _np.ones(8, dtype=vec_type)
+
+    assert result.dtype in ["float32", "complex64"]
+    _np.testing.assert_allclose(result, 24 * _np.ones(8))
+
+
+@pytest.mark.parametrize(
+    "vec",
+    [
+        _np.linspace(0, 1, 12),
+        _np.linspace(0, 1, 12) + 1j * _np.linspace(1, 2, 12),
+        _np.linspace(0, 1, 12).reshape(12, 1),
+        _np.linspace(0, 1, 24).reshape(12, 2),
+    ],
+)
+def test_sparse_matvec(vec):
+    """The sparse matvec agrees with the Scipy product."""
+    op = _random_sparse(12, 12)
+
+    _np.testing.assert_allclose(op @ vec, op.A @ vec)
+
+
+@pytest.mark.parametrize("shape", [(7,), (7, 1), (7, 3)])
+@pytest.mark.parametrize("precision", ["float32", "float64"])
+def test_dense_matvec_with_complex_vector(shape, precision):
+    """A real dense operator is correctly applied to complex vectors."""
+    rng = _np.random.default_rng(0)
+    mat = rng.random((5, 7)).astype(precision)
+    op = DenseDiscreteBoundaryOperator(mat)
+    x = rng.random(shape) + 1j * rng.random(shape)
+
+    actual = op @ x
+
+    assert actual.shape == (5,) + shape[1:]
+    assert actual.dtype == _np.result_type(precision, _np.complex64)
+    _np.testing.assert_allclose(actual, mat @ x, rtol=1e-5)
+
+
+def test_sparse_matmat_with_complex_vector():
+    """A real sparse operator is correctly applied to complex blocks."""
+    rng = _np.random.default_rng(0)
+    op = _random_sparse(12, 12)
+    x = rng.random((12, 3)) + 1j * rng.random((12, 3))
+
+    _np.testing.assert_allclose(op @ x, op.A @ x)
+
+
+@pytest.mark.parametrize("precision", ["float32", "complex64"])
+@pytest.mark.parametrize("scalar", [2.0, 2.0 + 1j])
+def test_dense_scalar_product_keeps_single_precision(precision, scalar):
+    """Scalar multiplication does not promote single precision operators."""
+    op = DenseDiscreteBoundaryOperator(_np.ones((3, 3), dtype=precision))
+
+    result = op * scalar
+
+    assert result.A.dtype in ["float32", "complex64"]
+    _np.testing.assert_allclose(result.A, scalar * _np.ones((3, 3)))
+
+
+@pytest.mark.parametrize("shape", [(6,), (6, 1), (6, 3)])
+def test_diagonal_operator(shape):
+    """The diagonal operator scales each row by the diagonal entry."""
+    rng = _np.random.default_rng(0)
+    values = rng.random(6)
+    op = DiagonalOperator(values)
+    x = rng.random(shape) + 1j * rng.random(shape)
+
+    _np.testing.assert_allclose(op @ x, _np.diag(values) @ x)
+
+
+def test_large_diagonal_operator():
+    """Large diagonal operators agree with the elementwise product."""
+    from bempp.api.assembly.discrete_boundary_operator import (
+        _DIAGONAL_NUMBA_THRESHOLD,
+    )
+
+    rng = _np.random.default_rng(0)
+    size = _DIAGONAL_NUMBA_THRESHOLD + 1
+    values = rng.random(size)
+    op = DiagonalOperator(values)
+
+    for x in [rng.random(size), rng.random(size) + 1j * rng.random(size)]:
+        _np.testing.assert_allclose(op @ x, values * x)
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 64])
+def test_to_dense_by_columns(block_size):
+    """Blockwise densification reproduces the matrix of the operator."""
+    from scipy.sparse.linalg import aslinearoperator
+    from bempp.api.assembly.discrete_boundary_operator import _to_dense_by_columns
+
+    rng = _np.random.default_rng(0)
+    mat = rng.random((7, 10)) + 1j * rng.random((7, 10))
+
+    actual = _to_dense_by_columns(aslinearoperator(mat), block_size)
+
+    _np.testing.assert_allclose(actual, mat)
+
+
+@pytest.mark.parametrize("workers", [1, 4, 64])
+def test_threaded_matmat(monkeypatch, workers):
+    """The threaded dense block product agrees with the serial product."""
+    # pylint: disable=protected-access
+    from bempp.api.assembly import discrete_boundary_operator
+
+    monkeypatch.setattr(discrete_boundary_operator, "_matmat_workers", lambda: workers)
+    rng = _np.random.default_rng(0)
+    mat = rng.random((9, 7))
+    x = rng.random((7, 20))
+    chunks = []
+
+    class Matrix:
+        """Matrix that records the number of columns of each product."""
+
+        def dot(self, y):
+            """Multiply with y."""
+            chunks.append(y.shape[1])
+            return mat @ y
+
+    result = discrete_boundary_operator._threaded_matmat(Matrix(), x)
+
+    _np.testing.assert_allclose(result, mat @ x)
+    assert len(chunks) == min(workers, 20)
+    assert min(chunks) > 0
+
+
+@pytest.mark.parametrize("precision", ["float32", "complex64", "float64"])
+@pytest.mark.parametrize("enabled", ["0", "1"])
+def test_threaded_matmat_dispatch(monkeypatch, precision, enabled):
+    """Only opted in single precision dense products are threaded."""
+    # pylint: disable=protected-access
+    from bempp.api.assembly import discrete_boundary_operator
+
+    calls = []
+
+    def threaded_matmat(A, x):
+        calls.append(x.shape)
+        return A @ x
+
+    monkeypatch.setenv("BEMPP_THREADED_MATMAT", enabled)
+    monkeypatch.setattr(discrete_boundary_operator, "_matmat_workers", lambda: 4)
+    monkeypatch.setattr(discrete_boundary_operator, "_threaded_matmat", threaded_matmat)
+    discrete_boundary_operator._use_threaded_matmat.cache_clear()
+
+    try:
+        op = discrete_boundary_operator.DenseDiscreteBoundaryOperator(
+            _np.ones((3, 3), dtype=precision)
+        )
+        result = op @ _np.ones((3, 20), dtype=precision)
+    finally:
+        discrete_boundary_operator._use_threaded_matmat.cache_clear()
+
+    _np.testing.assert_allclose(result, 3 * _np.ones((3, 20)))
+    expected = enabled == "1" and precision != "float64"
+    assert bool(calls) == expected
+
+
+def test_fused_product_matvec():
+    """Fused products agree with the successive application of both factors."""
+    op1 = _random_sparse(8, 8, 0)
+    op2 = _random_sparse(8, 8, 1)
+    op = _ProductDiscreteOperator(op1, op2)
+
+    rng = _np.random.default_rng(2)
+    x = rng.random(8) + 1j * rng.random(8)
+
+    _np.testing.assert_allclose(op @ x, op1 @ (op2 @ x))
+
+
+@pytest.mark.parametrize("alpha", [2.0, 2.0 + 1j])
+def test_scaled_operator(alpha):
+    """Scaled operators agree with the scaled matrix."""
+    from bempp.api.assembly.discrete_boundary_operator import _ScaledDiscreteOperator
+
+    op = _random_dense(6, 6)
+    scaled = _ScaledDiscreteOperator(op, alpha)
+    x = _np.linspace(0, 1, 6)
+
+    _np.testing.assert_allclose(scaled @ x, alpha * (op.A @ x))
+    _np.testing.assert_allclose(x, _np.linspace(0, 1, 6))
+
+
+class _MatrixEvaluator:
+    """Evaluator for generic operators based on a dense matrix."""
+
+    def __init__(self, mat):
+        self.mat = mat
+        self.dtype = mat.dtype
+        self.shape = mat.shape
+
+    def matvec(self, x):
+        """Apply the matrix."""
+        return self.mat @ x
+
+
+@pytest.mark.parametrize("precision", ["float64", "complex128"])
+def test_generic_operator(precision):
+    """Generic operators apply their evaluator to real and complex vectors."""
+    from bempp.api.assembly.discrete_boundary_operator import (
+        GenericDiscreteBoundaryOperator,
+    )
+
+    rng = _np.random.default_rng(0)
+    mat = rng.random((5, 4)).astype(precision)
+    op = GenericDiscreteBoundaryOperator(_MatrixEvaluator(mat))
+    x = rng.random(4) + 1j * rng.random(4)
+
+    _np.testing.assert_allclose(op @ x, mat @ x)
+    _np.testing.assert_allclose(op @ x.real, mat @ x.real)
+    _np.testing.assert_allclose(op.A, mat)
+
+
+@pytest.mark.parametrize("precision", ["float64", "complex128"])
+def test_generic_operator_copies(precision):
+    """Pickled and deep copied generic operators use their own evaluator."""
+    import copy
+    import pickle
+    from bempp.api.assembly.discrete_boundary_operator import (
+        GenericDiscreteBoundaryOperator,
+    )
+
+    mat = _np.ones((5, 4), dtype=precision)
+    op = GenericDiscreteBoundaryOperator(_MatrixEvaluator(mat))
+    x = _np.ones(4)
+
+    for other in [pickle.loads(pickle.dumps(op)), copy.deepcopy(op)]:
+        other._evaluator.mat *= 2  # pylint: disable=protected-access
+        _np.testing.assert_allclose(other @ x, 8 * _np.ones(5))
+        _np.testing.assert_allclose(op @ x, 4 * _np.ones(5))
+
+
+@pytest.mark.parametrize("read_only_result", [False, True])
+def test_zero_operator(read_only_result):
+    """Zero operators return zeros of the correct shape."""
+    op = ZeroDiscreteBoundaryOperator(4, 3, read_only_result=read_only_result)
+
+    _np.testing.assert_equal(op @ _np.ones(3), _np.zeros(4))
+    _np.testing.assert_equal(op @ _np.ones((3, 2)), _np.zeros((4, 2)))
+    _np.testing.assert_equal(-op @ (1j * _np.ones(3)), _np.zeros(4))
+    _np.testing.assert_equal((op + op) @ _np.ones(3), _np.zeros(4))
+    assert (op @ _np.ones(3)).flags.writeable != read_only_result
+
+
+def test_blocked_operator_with_zero_blocks():
+    """Blocked operators skip their zero blocks and hand out writeable ones."""
+    from bempp.api.assembly.blocked_operator import BlockedDiscreteOperator
+
+    ops = _np.empty((2, 2), dtype=object)
+    ops[0, 0] = _random_dense(3, 3, 0)
+    ops[1, 1] = _random_dense(2, 2, 1)
+    blocked = BlockedDiscreteOperator(ops)
+    x = _np.linspace(0, 1, 5) + 1j
+
+    expected = _np.zeros((5, 5))
+    expected[:3, :3] = ops[0, 0].A
+    expected[3:, 3:] = ops[1, 1].A
+    _np.testing.assert_allclose(blocked @ x, expected @ x)
+    assert (blocked[0, 1] @ _np.ones(2)).flags.writeable
+
+
+@pytest.mark.parametrize("shape", [(12, 8), (8, 12)])
+def test_inverse_of_rectangular_sparse_operator(shape):
+    """Rectangular sparse operators are inverted through the normal equations."""
+    op = _random_sparse(*shape)
+    inverse = InverseSparseDiscreteBoundaryOperator(op)
+
+    expected = _np.linalg.pinv(op.A.toarray())
+    _np.testing.assert_allclose(inverse.A, expected, rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize("shape", [(10, 10), (12, 8), (8, 12)])
+@pytest.mark.parametrize("rhs_shape", [(), (1,), (3,)])
+def test_inverse_sparse_with_complex_rhs(shape, rhs_shape):
+    """Real sparse inverses are applied to complex right-hand sides."""
+    op = _random_sparse(*shape)
+    inverse = InverseSparseDiscreteBoundaryOperator(op)
+
+    rng = _np.random.default_rng(0)
+    rhs = rng.random((shape[0],) + rhs_shape) + 1j * rng.random((shape[0],) + rhs_shape)
+
+    actual = inverse @ rhs
+
+    assert actual.shape == (shape[1],) + rhs_shape
+    _np.testing.assert_allclose(
+        actual, _np.linalg.pinv(op.A.toarray()) @ rhs, rtol=1e-8, atol=1e-10
+    )
+
+
+def test_product_of_sparse_and_dense_operator():
+    """Mixed products keep the sparse factor sparse."""
+    sparse_op = _random_sparse(8, 8)
+    dense_op = _random_dense(8, 8)
+    sparse_mat = sparse_op.A.toarray()
+    dense_mat = dense_op.A
+
+    _np.testing.assert_allclose(
+        _ProductDiscreteOperator(sparse_op, dense_op).A, sparse_mat @ dense_mat
+    )
+    _np.testing.assert_allclose(
+        _ProductDiscreteOperator(dense_op, sparse_op).A, dense_mat @ sparse_mat
+    )
+
+
+def test_densification_limit():
+    """Densification fails if it exceeds the configured limit."""
+    op = _SumDiscreteOperator(_random_sparse(8, 8), _random_dense(8, 8))
+
+    bempp.api.GLOBAL_PARAMETERS.assembly.max_densification_entries = 10
+    try:
+        with pytest.raises(ValueError):
+            op.A
+    finally:
+        bempp.api.GLOBAL_PARAMETERS.assembly.max_densification_entries = None
+
+
+@pytest.mark.parametrize("vec_type", ["float64", "complex128"])
+def test_product_of_single_precision_operators(vec_type):
+    """Products of single precision operators return single precision results."""
+    op1 = DenseDiscreteBoundaryOperator(_np.ones((8, 8), dtype="float32"))
+    op2 = DenseDiscreteBoundaryOperator(2 * _np.ones((8, 8), dtype="float32"))
+    op = _ProductDiscreteOperator(op1, op2)
+
+    result = op @ _np.ones(8, dtype=vec_type)
+
+    assert result.dtype in ["float32", "complex64"]
+    _np.testing.assert_allclose(result, 128 * _np.ones(8))